@@ -43,6 +43,16 @@ class AbstractAgent(ABC):
         """
         pass
 
+    def add_transition_batch(self, transitions: tuple) -> None:
+        """
+        Add a batch of transitions, one per vectorized environment, to the agent's replay buffer.
+        The default pushes them one at a time through add_transition; agents with a batched push override it.
+
+        :param transitions: (states, actions, rewards, next_states, dones), each batched along the first axis.
+        """
+        for transition in zip(*transitions):
+            self.add_transition(transition)
+
     @abstractmethod
     def update(self) -> None:
         """
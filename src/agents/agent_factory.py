@@ -15,8 +15,9 @@ class AgentFactory:
             """
 
             if env is not None:
-                config["state_space"] = env.observation_space
-                config["action_space"] = env.action_space
+                # Vector envs expose the per-environment spaces separately from the batched ones
+                config["state_space"] = getattr(env, "single_observation_space", env.observation_space)
+                config["action_space"] = getattr(env, "single_action_space", env.action_space)
 
             agent_str = config.get("agent_str", "RANDOM").upper()
 
@@ -1,3 +1,4 @@
+from typing import Union
 import numpy as np
 import torch
 from torch.optim.lr_scheduler import StepLR
@@ -20,6 +21,11 @@ class LAS_LyapunovAgent(DualPolicyAgent):
         self.integ_threshold = config.get("integ_threshold")
         self.dt = config.get("dt")
         self.r1_bounds = config.get("r1_bounds")
+        self.ce_weight = config.get("ce_weight", 1.0)
+        self.fast_sin = config.get("fast_sin", False)
+        self.seed = config.get("seed")
+        self.plot_every = config.get("plot_every", 0)
+        self.debug_grad_routing = config.get("debug_grad_routing", False)
         
         actor_hidden_sizes = config.get("actor_hidden_sizes")
         critic_hidden_sizes = config.get("critic_hidden_sizes")
@@ -47,6 +53,11 @@ class LAS_LyapunovAgent(DualPolicyAgent):
             r1_bounds=self.r1_bounds,
             run_dir=self.run_dir,
             device=self.device,
+            ce_weight=self.ce_weight,
+            fast_sin=self.fast_sin,
+            seed=self.seed,
+            plot_every=self.plot_every,
+            debug_grad_routing=self.debug_grad_routing,
         )
 
     def _get_global_action(self, state_torch: torch.Tensor) -> torch.Tensor:
@@ -73,7 +84,7 @@ class LAS_LyapunovAgent(DualPolicyAgent):
     def add_transition(self, transition: tuple) -> None:
         pass
 
-    def update(self, counter_examples: list = None):
+    def update(self, counter_examples: Union[list, torch.Tensor] = None):
         loss = self.trainer.train(counter_examples=counter_examples)
         return loss
     
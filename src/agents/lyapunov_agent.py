@@ -1,3 +1,4 @@
+from typing import Union
 import torch
 import numpy as np
 
@@ -21,11 +22,17 @@ class LyapunovAgent(AbstractAgent):
         self.norm_threshold = config.get("norm_threshold")
         self.integ_threshold = config.get("integ_threshold")
         self.r1_bounds = config.get("r1_bounds")
+        self.ce_weight = config.get("ce_weight", 1.0)
+        self.fast_sin = config.get("fast_sin", False)
+        self.seed = config.get("seed")
+        self.plot_every = config.get("plot_every", 0)
+        self.debug_grad_routing = config.get("debug_grad_routing", False)
         
         actor_hidden_sizes = config.get("actor_hidden_sizes")
         critic_hidden_sizes = config.get("critic_hidden_sizes")
 
         self.max_action = config.get("max_action")
+        self.compile_models = config.get("compile_models", False)
         
         self.actor_model = LyapunovActor(self.state_dim, actor_hidden_sizes, self.action_dim, max_action=self.max_action).to(device=self.device)
         self.critic_model = LyapunovCritic(self.state_dim, critic_hidden_sizes).to(device=self.device)
@@ -48,12 +55,18 @@ class LyapunovAgent(AbstractAgent):
             r1_bounds=self.r1_bounds,
             run_dir=self.run_dir,
             device=self.device,
+            compile_models=self.compile_models,
+            ce_weight=self.ce_weight,
+            fast_sin=self.fast_sin,
+            seed=self.seed,
+            plot_every=self.plot_every,
+            debug_grad_routing=self.debug_grad_routing,
         )
 
     def add_transition(self, transition: tuple) -> None:
         pass
 
-    def update(self, counter_examples: list = None):
+    def update(self, counter_examples: Union[list, torch.Tensor] = None):
         loss = self.trainer.train(counter_examples=counter_examples)
         return loss
 
@@ -75,6 +75,20 @@ class TD3Agent(AbstractAgent):
         done_t = torch.as_tensor([float(done)], device=self.device, dtype=torch.float32)
         self._replay_buffer.push((state_t, action_t, reward_t, next_state_t, done_t))
 
+    def add_transition_batch(self, transitions: tuple) -> None:
+        """
+        Add a batch of transitions with one tensor conversion per field instead of one per transition.
+        :param transitions: (states, actions, rewards, next_states, dones), each batched along the first axis.
+        """
+        states, actions, rewards, next_states, dones = transitions
+        states_t = torch.as_tensor(states, device=self.device, dtype=torch.float32)
+        actions_t = torch.as_tensor(actions, device=self.device, dtype=torch.float32)
+        rewards_t = torch.as_tensor(rewards, device=self.device, dtype=torch.float32)
+        next_states_t = torch.as_tensor(next_states, device=self.device, dtype=torch.float32)
+        dones_t = torch.as_tensor(dones, device=self.device, dtype=torch.float32).unsqueeze(1)
+        for transition in zip(states_t, actions_t, rewards_t, next_states_t, dones_t):
+            self._replay_buffer.push(transition)
+
     def update(self) -> None:
         """
         Perform a gradient descent step on both actor and critic.
@@ -87,11 +101,15 @@ class TD3Agent(AbstractAgent):
         This mimics the original code:
           action = actor(state) + N(0, expl_noise * max_action)
         and clips the result between -max_action and max_action.
+        A batch of states (one per vectorized environment) yields a batch of actions.
         """
         state_t = torch.as_tensor(state, device=self.device, dtype=torch.float32)
+        batched = state_t.dim() > 1
         with torch.no_grad():
-            action = self.actor_model(state_t.unsqueeze(0))
-        action = action.cpu().numpy().flatten()
+            action = self.actor_model(state_t if batched else state_t.unsqueeze(0))
+        action = action.cpu().numpy()
+        if not batched:
+            action = action.flatten()
         noise = np.random.normal(0, self.expl_noise * self.max_action, size=action.shape)
         action = np.clip(action + noise, -self.max_action, self.max_action)
         return action
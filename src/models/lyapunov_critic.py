@@ -20,17 +20,8 @@ class LyapunovCritic(nn.Module):
         return self.model(x).squeeze(-1)
     
     def forward_with_grad(self, x):
-        x.requires_grad_(True)        
-        y = self(x)
-        
-        grad = torch.autograd.grad(
-            outputs=y.sum(), 
-            inputs=x, 
-            create_graph=True
-        )[0]
-        
-        x.requires_grad_(False)
-        return y, grad
+        y, grad = self.model.forward_with_grad(x)
+        return y.squeeze(-1), grad
 
     def forward_dreal(self, x_vars):
         return self.model.forward_dreal(x_vars)
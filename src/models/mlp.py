@@ -1,10 +1,15 @@
 import numpy as np
+import torch
 import torch.nn as nn
 import dreal as d
 
 from util.dreal import dreal_var, dreal_elementwise, dreal_sigmoid
 
 
+# Layers whose input Jacobian forward_with_grad can chain analytically
+ANALYTIC_GRAD_LAYERS = (nn.Linear, nn.Tanh, nn.Sigmoid, nn.ReLU)
+
+
 class MLP(nn.Module):
     def __init__(self, input_size, hidden_sizes, output_size, inner_activation=nn.ReLU, output_activation=None):
         """
@@ -25,6 +30,38 @@ class MLP(nn.Module):
     def forward(self, x):
         return self.net(x)
 
+    def forward_with_grad(self, x):
+        """
+        Forward pass that also returns the gradient of the summed outputs w.r.t. x.
+        The layer Jacobians are chained analytically with batched matmuls, so no
+        create_graph autograd call (and no double backward) is needed.
+        Networks with other layers fall back to autograd.grad with create_graph=True.
+        returns: (y, grad) with shapes (batch, output_size) and (batch, input_size)
+        """
+        if not all(isinstance(layer, ANALYTIC_GRAD_LAYERS) for layer in self.net):
+            x_in = x if x.requires_grad else x.detach().requires_grad_(True)
+            h = self.net(x_in)
+            grad = torch.autograd.grad(outputs=h.sum(), inputs=x_in, create_graph=True)[0]
+            return h, grad
+
+        h = x
+        jacobians = []
+        for layer in self.net:
+            h = layer(h)
+            if isinstance(layer, nn.Linear):
+                jacobians.append(layer.weight)
+            elif isinstance(layer, nn.Tanh):
+                jacobians.append(1 - h * h)
+            elif isinstance(layer, nn.Sigmoid):
+                jacobians.append(h * (1 - h))
+            elif isinstance(layer, nn.ReLU):
+                jacobians.append((h > 0).to(h.dtype))
+
+        grad = torch.ones_like(h)
+        for layer, jac in zip(reversed(self.net), reversed(jacobians)):
+            grad = grad @ jac if isinstance(layer, nn.Linear) else grad * jac
+        return h, grad
+
     def forward_dreal(self, x_vars: np.ndarray):
         """
         x_vars : np.ndarray of d.Variable/d.Expression, shape (input_dim,)
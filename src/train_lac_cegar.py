@@ -1,5 +1,6 @@
 import os
 import numpy as np
+import torch
 
 import dreal as d
 
@@ -69,7 +70,8 @@ def run_cegar_training():
     ep_actor_losses = []
     ep_critic_losses = []
 
-    all_counter_examples = []
+    # Counter-examples live on the agent's device and grow by one row per CEGAR iteration
+    all_counter_examples = torch.empty((0, config_lac["state_space"].shape[0]), dtype=torch.float32, device=agent.device)
 
     logger.info("Starting CEGAR Training Loop...") 
     for i in range(MAX_CEGAR_ITERATIONS):
@@ -101,7 +103,8 @@ def run_cegar_training():
             new_ce = extract_ce_from_model(ce_model, config_lac["state_space"].shape[0])
             logger.info(ce_model)
             logger.info(f"Falsifier found counter-example: {np.round(new_ce, 4)}. Adding to training set.")
-            all_counter_examples.append(new_ce)
+            new_ce_t = torch.as_tensor(new_ce, dtype=torch.float32, device=agent.device).unsqueeze(0)
+            all_counter_examples = torch.cat([all_counter_examples, new_ce_t], dim=0)
             agent.save(file_path=run_dir, episode=(i + 1) * TRAINING_STEPS_PER_ITERATION)
 
         logger.info(f"Model saved to {run_dir}")
@@ -109,6 +112,7 @@ def run_cegar_training():
     else:
         logger.warning("\nTRAINING FAILED: Max CEGAR iterations reached without full verification.")
 
+    agent.trainer.close()
     logger.info("Training Finished")
     tracker.add_run_losses(model_name, ep_actor_losses, ep_critic_losses)
     tracker.save_top10_losses_plot(folder=run_dir)
@@ -66,6 +66,7 @@ def train_lac():
             agent.save(file_path=run_dir, episode=(episode + 1)) 
             logger.info(f"Model weights saved to {run_dir}")
 
+    agent.trainer.close()
     logger.info("Training Finished")
 
     tracker.add_run_losses(model_name, ep_actor_losses, ep_critic_losses)
@@ -69,7 +69,8 @@ def run_las_lyapunov_ac_cegar_training():
     TRAINING_STEPS_PER_ITERATION = 1000
     CERTIFICATION_LEVEL_C = 0.5
     
-    all_counter_examples = []
+    # Counter-examples live on the agent's device and grow by one row per CEGAR iteration
+    all_counter_examples = torch.empty((0, config["state_space"].shape[0]), dtype=torch.float32, device=agent.device)
     total_actor_losses = []
     total_critic_losses = []
 
@@ -106,7 +107,8 @@ def run_las_lyapunov_ac_cegar_training():
             new_ce = extract_ce_from_model(ce_model, config["state_space"].shape[0])
             logger.info(new_ce)
             logger.info(f"Falsifier found counter-example: {np.round(new_ce, 4)}. Adding to training set.")
-            all_counter_examples.append(new_ce)
+            new_ce_t = torch.as_tensor(new_ce, dtype=torch.float32, device=agent.device).unsqueeze(0)
+            all_counter_examples = torch.cat([all_counter_examples, new_ce_t], dim=0)
             agent.save(file_path=run_dir, episode=(i + 1) * TRAINING_STEPS_PER_ITERATION)
 
         logger.info(f"Model saved to {run_dir}")
@@ -114,6 +116,7 @@ def run_las_lyapunov_ac_cegar_training():
     else:
         logger.error("\nTRAINING FAILED: Max CEGAR iterations reached without full verification.")
 
+    agent.trainer.close()
     logger.info("Training Finished")
     tracker.add_run_losses(model_name, total_actor_losses, total_critic_losses)
     tracker.save_top10_losses_plot(folder=run_dir)
@@ -78,6 +78,9 @@ def main():
     total_actor_losses = []
     total_critic_losses = []
 
+    # RK4 stage outputs are reused across steps instead of being reallocated
+    rk4_bufs = tuple(np.empty((1, 2)) for _ in range(4))
+
     for episode in range(NUM_EPISODES):
         ep_actor_losses = []
         ep_critic_losses = []
@@ -98,7 +101,7 @@ def main():
             else:
                 action = agent.policy(current_state) 
 
-            next_state = rk4_step(pendulum_dynamics_np, current_state, action, DT).squeeze()
+            next_state = rk4_step(pendulum_dynamics_np, current_state, action, DT, bufs=rk4_bufs).squeeze()
 
             next_state[0] = (next_state[0] + np.pi) % (2 * np.pi) - np.pi
             next_state[1] = np.clip(next_state[1], -8.0, 8.0) 
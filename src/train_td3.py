@@ -55,6 +55,9 @@ def main():
     total_actor_losses = []
     total_critic_losses = []
 
+    # RK4 stage outputs are reused across steps instead of being reallocated
+    rk4_bufs = tuple(np.empty((1, 2)) for _ in range(4))
+
     for episode in range(NUM_EPISODES):
         ep_rewards = []
         ep_actor_losses = []
@@ -79,7 +82,7 @@ def main():
                 action_np = agent.policy(current_state_np)
                 action_torch = torch.as_tensor(action_np, dtype=torch.float32, device=DEVICE)
 
-            next_state_np = rk4_step(pendulum_dynamics_np, current_state_np, action_np, DT).squeeze()
+            next_state_np = rk4_step(pendulum_dynamics_np, current_state_np, action_np, DT, bufs=rk4_bufs).squeeze()
 
             next_state_np[0] = (next_state_np[0] + np.pi) % (2 * np.pi) - np.pi
             next_state_np[1] = np.clip(next_state_np[1], -8.0, 8.0) 
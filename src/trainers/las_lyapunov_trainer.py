@@ -1,14 +1,18 @@
 import os
+from typing import Union
 import numpy as np
-import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import torch
 import torch.nn.functional as F
 import dreal as d
 
 from agents.abstract_agent import AbstractAgent
 from trainers.abstract_trainer import Trainer
-from util.sampling import sample_in_region_torch, sample_out_of_region_torch
+from util.sampling import sample_in_region_torch, sample_out_of_region_scaled_torch
 from util.rk4_step import rk4_step
+from util.dynamics import pendulum_dynamics_torch, rk4_pendulum_step
 from util.dreal import dreal_var, in_box, on_boundary, is_unsat
 
 
@@ -29,6 +33,11 @@ class LAS_LyapunovAC_Trainer(Trainer):
         r1_bounds: list,
         run_dir: str,
         device: str,
+        ce_weight: float = 1.0,
+        fast_sin: bool = False,
+        seed: int = None,
+        plot_every: int = 0,
+        debug_grad_routing: bool = False,
     ):
         super().__init__()
         self.agent = agent
@@ -50,36 +59,78 @@ class LAS_LyapunovAC_Trainer(Trainer):
 
         self.device = device
 
-        self.lb_tensor = torch.tensor(self.lb, dtype=torch.float32, device=self.device)
-        self.ub_tensor = torch.tensor(self.ub, dtype=torch.float32, device=self.device)
+        self.lb_tensor = torch.as_tensor(self.lb, dtype=torch.float32, device=self.device)
+        self.ub_tensor = torch.as_tensor(self.ub, dtype=torch.float32, device=self.device)
+        # Device-side copies of the scalar hyperparameters used in the loss and rollout arithmetic
+        self.alpha_tensor = torch.tensor(self.alpha_zubov, dtype=torch.float32, device=self.device)
+        self.dt_tensor = torch.tensor(self.dt, dtype=torch.float32, device=self.device)
+        self.norm_threshold_tensor = torch.tensor(self.norm_threshold, dtype=torch.float32, device=self.device)
+        self.integ_threshold_tensor = torch.tensor(self.integ_threshold, dtype=torch.float32, device=self.device)
+        # R2 samples are drawn against ub * 2, which never changes during training
+        self._ub_scaled = self.ub_tensor * 2.0
+
+        # All training samples come from one on-device generator, seeded for reproducibility when a seed is given
+        self._gen = torch.Generator(device=self.device)
+        if seed is not None:
+            self._gen.manual_seed(seed)
+        else:
+            self._gen.seed()
+
+        # Level-set plots are off by default; when enabled, only the 1-D grid axes are kept
+        # and the matplotlib work runs on a background thread
+        self.plot_every = plot_every
+        self._plot_future = None
+        if self.plot_every > 0:
+            self._plot_xx = np.linspace(self.lb[0]*2, self.ub[0]*2, 500)
+            self._plot_yy = np.linspace(self.lb[1]*2, self.ub[1]*2, 500)
+            self._plot_executor = ThreadPoolExecutor(max_workers=1)
+
+        self._zero_state = torch.zeros((1, self.state_dim), dtype=torch.float32, device=self.device)
+        self._one = torch.ones((), dtype=torch.float32, device=self.device)
+
+        self.debug_grad_routing = debug_grad_routing
+
+        self.ce_weight = ce_weight
+
+        # The pendulum has a fused, scripted RK4 step; other dynamics use the generic rk4_step.
+        # fast_sin swaps torch.sin for a polynomial in the rollouts only, not in the PDE loss.
+        if dynamics_fn is pendulum_dynamics_torch:
+            self._rk4_step = lambda f, x, u, dt: rk4_pendulum_step(x, u, dt, use_fast_sin=fast_sin)
+        else:
+            self._rk4_step = rk4_step
 
         self.timesteps = 0
 
         print('Lyapunov Trainer Initialized (Dual-Policy Lyapunov AC)!')
 
-    def train(self, counter_examples: list = None):
-        init_states = sample_in_region_torch(self.num_paths_sampled, self.lb_tensor, self.ub_tensor, self.device)
-        traj, values, _ = self.simulate_trajectories(init_states, max_steps=3000)
-        values = values.to(dtype=torch.float32, device=self.device)
+    def train(self, counter_examples: Union[list, torch.Tensor] = None):
+        init_states, values = self.simulate_trajectories_batch(self.num_paths_sampled, max_steps=3000)
+
+        # R1 samples for the PDE residual (counter-examples first) and R2 boundary samples
+        n_ce = 0
+        if counter_examples is not None and len(counter_examples) > 0:
+            ce_tensor = self._counter_example_tensor(counter_examples)
+            n_ce = ce_tensor.shape[0]
+            random_samples = sample_in_region_torch(self.batch_size - n_ce, self.lb_tensor, self.ub_tensor, self.device, generator=self._gen)
+            init_states_in = torch.cat([ce_tensor, random_samples], dim=0)
+        else:
+            init_states_in = sample_in_region_torch(self.batch_size, self.lb_tensor, self.ub_tensor, self.device, generator=self._gen)
+
+        init_states_out = sample_out_of_region_scaled_torch(self.batch_size, self._ub_scaled, self._gen)
+
+        # Lr and Lb share a single composite W forward, only Lp needs grad_x W(x)
+        n_r = init_states.shape[0]
+        W_all = self.agent.get_composite_W_value(torch.cat([init_states, init_states_out], dim=0))
+        Wx_Lr, Wx_out = W_all[:n_r], W_all[n_r:]
 
         # 1) Enforce W(0) = 0
-        zero_tensor = torch.zeros((1, self.state_dim), device=self.device)
-        W_zeros = self.agent.critic_model(zero_tensor)
-        Lz = 5.0 * torch.square(W_zeros)
+        Lz = 5.0 * torch.square(self.agent.critic_model(self._zero_state))
 
         # 2) Enforce W(x) = tanh(alpha * V(x))
-        Wx_Lr = self.agent.get_composite_W_value(init_states)
-        target = torch.tanh(self.alpha_zubov * values)
+        target = torch.tanh(self.alpha_tensor * values)
         Lr = F.mse_loss(Wx_Lr, target)
 
         # 3) Physics-Informed Loss (PDE residual)
-        if counter_examples is not None and len(counter_examples) > 0:
-            ce_tensor = torch.as_tensor(counter_examples, dtype=torch.float32, device=self.device)
-            random_samples = sample_in_region_torch(self.batch_size - len(counter_examples), self.lb_tensor, self.ub_tensor, self.device)
-            init_states_in = torch.cat([ce_tensor, random_samples], dim=0)
-        else:
-            init_states_in = sample_in_region_torch(self.batch_size, self.lb_tensor, self.ub_tensor, self.device)
-        
         init_states_in.requires_grad_(True)
         Wx_in = self.agent.get_composite_W_value(init_states_in)
 
@@ -89,131 +140,219 @@ class LAS_LyapunovAC_Trainer(Trainer):
             create_graph=True
         )
 
-        global_actions = self.agent._get_global_action(init_states_in)
-        current_actions = self.agent._get_blended_action(init_states_in, global_actions)
+        # Only the critic needs x in the graph; the actor, f(x, u) and phi(x) use a detached copy
+        x_in = init_states_in.detach()
+        global_actions = self.agent._get_global_action(x_in)
+        current_actions = self.agent._get_blended_action(x_in, global_actions)
 
-        current_fxu = self.dynamics_fn(init_states_in, current_actions)
+        current_fxu = self.dynamics_fn(x_in, current_actions)
 
-        phix = torch.norm(init_states_in, p=2, dim=1)
+        # Lp treats f(x, u) as a constant and Lc treats grad_x W(x) as a constant, so the critic
+        # and the actor each only receive gradients from their own term in the joint backward
+        fxu_detached = current_fxu.detach()
+        grad_Wx_detached = grad_Wx_in.detach()
 
-        resid = torch.sum(grad_Wx_in * current_fxu.detach(), dim=1) + \
-            self.alpha_zubov * (1 + Wx_in.squeeze()) * (1 - Wx_in.squeeze()) * phix
-        Lp = torch.mean(torch.square(resid))
+        phix = x_in.pow(2).sum(dim=1).sqrt()
+
+        resid = torch.sum(grad_Wx_in * fxu_detached, dim=1) + \
+            self.alpha_tensor * (1 + Wx_in.squeeze()) * (1 - Wx_in.squeeze()) * phix
+        sq_resid = torch.square(resid)
+        if n_ce > 0 and self.ce_weight != 1.0:
+            sq_resid = torch.cat([self.ce_weight * sq_resid[:n_ce], sq_resid[n_ce:]])
+        Lp = torch.mean(sq_resid)
 
         # 4) Encourage control actions that decrease the Lyapunov function
-        Lc = 0.5 * torch.mean(torch.sum(grad_Wx_in.detach() * current_fxu, dim=1))
+        Lc = 0.5 * torch.mean(torch.sum(grad_Wx_detached * current_fxu, dim=1))
 
         # 5) Enforce that on the boundary of R2, W(x) \approx 1
-        init_states_out = sample_out_of_region_torch(self.batch_size, self.lb_tensor, self.ub_tensor, scale=2, device=self.device)
-        Wx_out = self.agent.get_composite_W_value(init_states_out)
-        Lb = 5.0 * F.l1_loss(Wx_out, torch.ones_like(Wx_out).to(self.device))
+        Lb = 5.0 * F.l1_loss(Wx_out, self._one.expand_as(Wx_out))
 
         actor_loss = Lc
         critic_loss = Lz + Lr + Lp + Lb
 
+        if self.debug_grad_routing:
+            self._check_grad_routing(actor_loss, critic_loss)
+
         total_loss = 0.5 * actor_loss + critic_loss
-        self.agent.optimizer.zero_grad()
+        self.agent.optimizer.zero_grad(set_to_none=True)
         total_loss.backward()
         self.agent.optimizer.step()
         self.agent.scheduler.step()
 
         self.timesteps += 1
-        if self.timesteps % 20 == 0:
+        if self.plot_every > 0 and self.timesteps % self.plot_every == 0:
             self.plot_level_set_and_trajectories()
             
         print(f"Lz: {Lz.item():.4f} | Lr: {Lr.item():.4f} | Lp: {Lp.item():.4f} | Lc: {Lc.item():.4f} | Lb: {Lb.item():.4f}")
         return actor_loss.item(), critic_loss.item()
 
+    def _check_grad_routing(self, actor_loss: torch.Tensor, critic_loss: torch.Tensor):
+        """
+        Debug check for the joint backward: Lc must not reach the critic parameters
+        and the critic losses must not reach the actor parameters.
+        """
+        critic_grads = torch.autograd.grad(actor_loss, list(self.agent.critic_model.parameters()), retain_graph=True, allow_unused=True)
+        assert all(g is None for g in critic_grads), "Lc backpropagates into the critic"
+        actor_grads = torch.autograd.grad(critic_loss, list(self.agent.actor_model.parameters()), retain_graph=True, allow_unused=True)
+        assert all(g is None for g in actor_grads), "Critic losses backpropagate into the actor"
+
+    def _counter_example_tensor(self, counter_examples) -> torch.Tensor:
+        """
+        Returns the counter-examples as a [n_ce, state_dim] tensor on the trainer's device.
+        A tensor already on the device with float32 dtype is returned without a copy.
+        """
+        if torch.is_tensor(counter_examples):
+            return counter_examples.to(dtype=torch.float32, device=self.device)
+        return torch.as_tensor(np.asarray(counter_examples), dtype=torch.float32, device=self.device)
+
+    @torch.no_grad()
+    def simulate_trajectories_batch(self, n: int, max_steps: int = 3000, sync_every: int = 32):
+        """
+        History-free rollout of n trajectories started from random states in R1.
+        :param n: Number of trajectories to simulate.
+        :param max_steps: Maximum simulation steps.
+        :param sync_every: Number of steps between host-side checks for early termination.
+        :return: init_states: tensor of shape [n, state_space] with the initial states,
+                integ_acc: integrated norm per trajectory.
+        """
+        init_states = sample_in_region_torch(n, self.lb_tensor, self.ub_tensor, self.device, generator=self._gen)
+        _, integ_acc, _ = self._rollout(init_states, max_steps, sync_every)
+        return init_states, integ_acc
+
     @torch.no_grad()
-    def simulate_trajectories(self, x: torch.Tensor, max_steps: int = 3000):
+    def simulate_trajectories(self, x: torch.Tensor, max_steps: int = 3000, sync_every: int = 32, buf_cap: int = 4096):
         """
-        Vectorized simulation for a batch of trajectories.
+        Vectorized simulation for a batch of trajectories, keeping the full history.
         :param x: Initial state tensor of shape [B, state_space].
         :param max_steps: Maximum simulation steps.
+        :param sync_every: Number of steps between host-side checks for early termination.
+        :param buf_cap: Initial number of time steps allocated for the history buffer.
         :return: traj: tensor of shape [B, T, state_space] containing the full trajectory history,
                 integ_acc: integrated norm per trajectory,
                 converged: convergence flags.
         """
+        history = torch.empty((x.shape[0], min(buf_cap, max_steps + 1), x.shape[1]), device=self.device)
+        x, integ_acc, traj = self._rollout(x, max_steps, sync_every, history=history)
+        final_norm = x.pow(2).sum(dim=1).sqrt()
+        converged = final_norm < self.norm_threshold_tensor
+
+        return traj, integ_acc, converged
+
+    def _rollout(self, x: torch.Tensor, max_steps: int, sync_every: int, history: torch.Tensor = None):
+        """
+        Rolls out the closed-loop dynamics until every trajectory converged, stabilized or diverged.
+        Terminated trajectories are frozen in place.
+        :param x: Initial state tensor of shape [B, state_space].
+        :param history: Optional preallocated [B, cap, state_space] buffer for the trajectory history,
+                        grown by doubling when full.
+        :return: x: final states,
+                integ_acc: integrated norm per trajectory,
+                traj: [B, T, state_space] history, or None when no buffer is given.
+        """
         B = x.shape[0]
         integ_acc = torch.zeros(B, device=self.device)
-        active = torch.ones(B, dtype=torch.bool, device=self.device)
-        x_hist = [x.clone()]
-        buffer = x.clone()
+        alive = torch.ones(B, dtype=torch.bool, device=self.device)
+        # Stabilization compares x against a snapshot refreshed every 10 steps, i.e. 1 to 10 steps back
+        snapshot = x.clone()
+        if history is not None:
+            history[:, 0] = x
+        T = 1
 
         for step in range(max_steps):
-            if not active.any():
-                break
+            norm = x.pow(2).sum(dim=1).sqrt()
+            integ_acc += norm * self.dt_tensor * alive
 
-            norm = torch.linalg.vector_norm(x, ord=2, dim=1)
-            integ_acc[active] += norm[active] * self.dt
-
-            converged = norm < self.norm_threshold
             if step >= 10:
-                stabilization = torch.linalg.vector_norm(x - buffer, ord=2, dim=1) < 1e-3 
+                stabilized = (x - snapshot).pow(2).sum(dim=1) < 1e-3 ** 2
             else:
-                stabilization = torch.zeros_like(norm, dtype=torch.bool)
-            diverged = integ_acc > self.integ_threshold
-            finished = converged | stabilization | diverged
-            active = active & (~finished)
-
+                stabilized = torch.zeros_like(alive)
             if step % 10 == 0:
-                buffer = x.clone()
+                snapshot.copy_(x)
 
-            if active.any():
-                pi_glob = self.agent.actor_model(x)
-                u = self.agent._get_blended_action(x, pi_glob)
+            alive &= ~(norm < self.norm_threshold_tensor) & ~stabilized & ~(integ_acc > self.integ_threshold_tensor)
+            # alive.any() forces a device sync, so only check for termination every few steps
+            if (step + 1) % sync_every == 0 and not alive.any():
+                break
 
-                if u.dim() == 1:
-                    u = u.unsqueeze(1)
-                x_next = rk4_step(self.dynamics_fn, x, u, dt=self.dt)
-                # Only update the active trajectories
-                x = torch.where(active.unsqueeze(1), x_next, x)
-                x_hist.append(x.clone())
+            pi_glob = self.agent.actor_model(x)
+            u = self.agent._get_blended_action(x, pi_glob)
+            if u.dim() == 1:
+                u = u.unsqueeze(1)
+            x_next = self._rk4_step(self.dynamics_fn, x, u, dt=self.dt)
+            # Freeze the trajectories that already terminated
+            x = torch.where(alive.unsqueeze(1), x_next, x)
 
-        traj = torch.stack(x_hist, dim=1)
-        final_norm = torch.linalg.vector_norm(x, ord=2, dim=1)
-        converged = final_norm < self.norm_threshold
+            if history is not None:
+                if T == history.shape[1]:
+                    history = torch.cat([history, torch.empty_like(history)], dim=1)
+                history[:, T] = x
+                T += 1
+
+        traj = history[:, :T] if history is not None else None
+        return x, integ_acc, traj
 
-        return traj, integ_acc, converged
-    
     def plot_level_set_and_trajectories(self):
-        x_min, x_max = self.lb[0]*2, self.ub[0]*2
-        y_min, y_max = self.lb[1]*2, self.ub[1]*2
-
-        xx = np.linspace(x_min, x_max, 500)
-        yy = np.linspace(y_min, y_max, 500)
-        X, Y = np.meshgrid(xx, yy)
-        grid_points = np.stack([X.flatten(), Y.flatten()], axis=1)
-        grid_tensor = torch.as_tensor(grid_points, dtype=torch.float32, device=self.device)
-        
+        """
+        Evaluates W on the plot grid and simulates a few trajectories on the training thread,
+        then hands the figure to the background plotter. Waits for the previous plot first,
+        so at most one is pending and its errors are raised here.
+        """
+        xx = torch.as_tensor(self._plot_xx, dtype=torch.float32, device=self.device)
+        yy = torch.as_tensor(self._plot_yy, dtype=torch.float32, device=self.device)
+        Y, X = torch.meshgrid(yy, xx, indexing="ij")
+        grid = torch.stack([X.reshape(-1), Y.reshape(-1)], dim=1)
+
         with torch.no_grad():
-            Z = self.agent.get_composite_W_value(grid_tensor)
+            Z = self.agent.get_composite_W_value(grid)
             Z = Z.cpu().numpy()
-        Z = Z.reshape(X.shape)
-        
-        plt.figure(figsize=(6,5))
-        cp = plt.contourf(X, Y, Z, levels=100, cmap='viridis')
-        plt.colorbar(cp)
-        plt.title("Critic Level Set (Lyapunov Function)")
-        plt.xlabel("x[0]")
-        plt.ylabel("x[1]")
-        plt.xlim(x_min, x_max)
-        plt.ylim(y_min, y_max)
+        Z = Z.reshape(len(self._plot_yy), len(self._plot_xx))
+        del grid, X, Y
 
         init_states = sample_in_region_torch(5, self.lb_tensor, self.ub_tensor, self.device)
         trajs, _, _ = self.simulate_trajectories(init_states, max_steps=3000)
-        trajs_np = trajs.cpu().numpy()
-        
-        for i in range(trajs_np.shape[0]):
-            plt.plot(trajs_np[i, :, 0], trajs_np[i, :, 1], 'o-', markersize=1, linewidth=0.5, color='r')
-            plt.plot(trajs_np[i, 0, 0], trajs_np[i, 0, 1], 'r+')
-        
-        plt.gca().set_aspect('equal')
+        trajs_np = trajs.detach().cpu().numpy()
+
         level_set_dir = os.path.join(self.run_dir, "level_sets")
         os.makedirs(level_set_dir, exist_ok=True)
         plot_path = os.path.join(level_set_dir, f"level_set_{self.timesteps}.png")
-        plt.savefig(plot_path)
-        plt.close()
+
+        if self._plot_future is not None:
+            self._plot_future.result()
+        self._plot_future = self._plot_executor.submit(self._save_level_set_plot, Z, trajs_np, plot_path)
+
+    def close(self):
+        """
+        Waits for the pending level-set plot, raising its error if it failed, and shuts down the plotter.
+        Call once training is finished.
+        """
+        if self.plot_every <= 0:
+            return
+        try:
+            if self._plot_future is not None:
+                self._plot_future.result()
+        finally:
+            self._plot_future = None
+            self._plot_executor.shutdown()
+
+    def _save_level_set_plot(self, Z: np.ndarray, trajs_np: np.ndarray, plot_path: str):
+        # pyplot is not thread-safe, so draw on a standalone Agg figure
+        fig = Figure(figsize=(6,5))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        cp = ax.contourf(self._plot_xx, self._plot_yy, Z, levels=100, cmap='viridis')
+        fig.colorbar(cp, ax=ax)
+        ax.set_title("Critic Level Set (Lyapunov Function)")
+        ax.set_xlabel("x[0]")
+        ax.set_ylabel("x[1]")
+        ax.set_xlim(self.lb[0]*2, self.ub[0]*2)
+        ax.set_ylim(self.lb[1]*2, self.ub[1]*2)
+
+        for i in range(trajs_np.shape[0]):
+            ax.plot(trajs_np[i, :, 0], trajs_np[i, :, 1], 'o-', markersize=1, linewidth=0.5, color='r')
+            ax.plot(trajs_np[i, 0, 0], trajs_np[i, 0, 1], 'r+')
+
+        ax.set_aspect('equal')
+        fig.savefig(plot_path)
 
     def in_domain_dreal(self, x, scale=1.0):
         return d.And(
@@ -7,6 +7,7 @@ import logging
 from agents.abstract_agent import AbstractAgent
 from agents.agent_factory import AgentFactory
 from util.metrics_tracker import MetricsTracker
+from util.welford import Welford
 from util.dynamics import (
     pendulum_dynamics_torch,
     pendulum_dynamics_dreal,
@@ -45,66 +46,93 @@ def show_last_episode(env_str: str, agent: AbstractAgent):
     env.close()
 
 
-def update_agent(agent: AbstractAgent, ep_actor_losses: list, ep_critic_losses: list):
+def update_agent(agent: AbstractAgent, ep_actor_losses: Welford, ep_critic_losses: Welford):
     loss = agent.update()
     if loss:
         actor_loss, critic_loss = loss
         if actor_loss:
-            ep_actor_losses.append(actor_loss)
-        ep_critic_losses.append(critic_loss)
+            ep_actor_losses.update_aggr(actor_loss)
+        ep_critic_losses.update_aggr(critic_loss)
+
+
+# Agents whose policy takes a batch of states and whose replay buffer is sampled uniformly,
+# so transitions from several environments can be interleaved
+VECTOR_ENV_AGENTS = ("TD3",)
 
 
 def run_episode(env_str: str, config: dict, num_episodes: int):
-    env = gym.make(env_str)
+    agent_str = config.get("agent_str")
+
+    # With num_envs > 1, step that many copies of the environment in lockstep and batch the policy over them.
+    # A single environment keeps the plain env, its observations are given a leading batch axis of 1.
+    num_envs = config.get("num_envs", 1)
+    vectorized = num_envs > 1
+    if vectorized:
+        if agent_str not in VECTOR_ENV_AGENTS:
+            raise ValueError(f"num_envs > 1 is only supported for {VECTOR_ENV_AGENTS}, got agent {agent_str}")
+        env = gym.vector.SyncVectorEnv([lambda: gym.make(env_str) for _ in range(num_envs)])
+    else:
+        env = gym.make(env_str)
     agent = AgentFactory.create_agent(config=config, env=env)
 
-    episode_returns = []
-    episode_actor_losses = []
-    episode_critic_losses = []
+    episode_returns = np.empty(num_episodes)
+    episode_actor_losses = np.empty(num_episodes)
+    episode_critic_losses = np.empty(num_episodes)
     total_stab = 0
 
     start_episodes = config.get("start_episodes", 125)
     update_threshold = config.get("batch_size", 256)
 
-    agent_str = config.get("agent_str")
-
     for episode in range(num_episodes):
-        ep_return = 0.0
-        ep_actor_losses = []
-        ep_critic_losses = []
-        done = False
+        ep_return = np.zeros(num_envs)
+        ep_actor_losses = Welford()
+        ep_critic_losses = Welford()
+        done = np.zeros(num_envs, dtype=bool)
         obs, _ = env.reset()
+        if not vectorized:
+            obs = obs[None]
+        last_obs = obs
 
-        while not done:
+        while not done.all():
             old_obs = obs
+            policy_obs = old_obs if vectorized else old_obs[0]
             if agent_str == "TD3":
                 # Use random actions during the initial exploration phase.
                 if episode < start_episodes:
                     action = env.action_space.sample()
                 else:
-                    action = agent.policy(old_obs)
+                    action = agent.policy(policy_obs)
             else:
-                action = agent.policy(old_obs)
+                action = agent.policy(policy_obs)
             obs, reward, terminated, truncated, _ = env.step(action)
-            ep_return += reward
-            done = terminated or truncated
-            agent.add_transition((old_obs, action, reward, obs, done))
+            if not vectorized:
+                obs, action = obs[None], np.asarray(action)[None]
+                reward, terminated, truncated = np.array([reward]), np.array([terminated]), np.array([truncated])
+
+            # Environments that finished earlier are auto-reset by this step, drop their transitions
+            live = ~done
+            step_done = terminated | truncated
+            ep_return += reward * live
+            last_obs = np.where(live[:, None], old_obs, last_obs)
+            agent.add_transition_batch((old_obs[live], action[live], reward[live], obs[live], step_done[live]))
+            done |= step_done
 
             # Only update if we're past the random phase.
-            if episode >= start_episodes and (len(agent._replay_buffer) >= update_threshold or done):
+            if episode >= start_episodes and (len(agent._replay_buffer) >= update_threshold or done.all()):
                 update_agent(agent, ep_actor_losses, ep_critic_losses)
 
         # Calculate stability (assumes pendulum state: cos, sin, theta_dot)
-        cos_theta, sin_theta, _ = old_obs
+        cos_theta, sin_theta = last_obs[:, 0], last_obs[:, 1]
         theta = np.arctan2(sin_theta, cos_theta)
-        if abs(theta) < 0.3 * np.pi:
-            total_stab += 1
-            
-        episode_returns.append(ep_return)
-        avg_actor_loss = np.mean(ep_actor_losses) if ep_actor_losses else 0.0
-        avg_critic_loss = np.mean(ep_critic_losses) if ep_critic_losses else 0.0
-        episode_actor_losses.append(avg_actor_loss)
-        episode_critic_losses.append(avg_critic_loss)
+        total_stab += int(np.sum(np.abs(theta) < 0.3 * np.pi))
+
+        # Running means are 0.0 when the agent was not updated this episode
+        ep_return = float(np.mean(ep_return))
+        avg_actor_loss = ep_actor_losses.mean
+        avg_critic_loss = ep_critic_losses.mean
+        episode_returns[episode] = ep_return
+        episode_actor_losses[episode] = avg_actor_loss
+        episode_critic_losses[episode] = avg_critic_loss
 
         if (episode + 1) % 1 == 0:
             logger.info(f"Episode {episode+1}/{num_episodes} | Return: {ep_return:.2f} "
@@ -357,6 +385,7 @@ def train_lac():
         if (episode + 1) % 1000 == 0:
             agent.save('./saved_models/lac/run_2') 
 
+    agent.trainer.close()
     tracker.add_run_losses('LAC', ep_actor_losses, ep_critic_losses)
 
     tracker.save_top10_losses_plot(folder='plots/lac/run_2')
@@ -1,6 +1,24 @@
+import math
 import numpy as np
 import torch
 import dreal as d
+from typing import Optional
+
+
+def fast_sin(x: torch.Tensor) -> torch.Tensor:
+    """
+    Polynomial approximation of sin(x) with max abs error ~6e-7.
+    x is wrapped to [-pi, pi] and folded onto [-pi/2, pi/2] via sin(x) = sin(pi - x),
+    where a degree-7 odd minimax polynomial is evaluated.
+    """
+    x = x - 2.0 * math.pi * torch.round(x / (2.0 * math.pi))
+    x = torch.where(x > 0.5 * math.pi, math.pi - x, torch.where(x < -0.5 * math.pi, -math.pi - x, x))
+    x2 = x * x
+    return x * (0.9999966159 + x2 * (-0.1666482838 + x2 * (0.008306325188 + x2 * -0.0001836365295)))
+
+
+def _sin(x: torch.Tensor, use_fast_sin: bool) -> torch.Tensor:
+    return fast_sin(x) if use_fast_sin else torch.sin(x)
 
 
 def gym_pendulum_dynamics(xs, us):
@@ -30,6 +48,7 @@ def gym_pendulum_dynamics(xs, us):
     return dxdt
 
 
+@torch.jit.script
 def pendulum_dynamics_torch(
     state: torch.Tensor,
     action: torch.Tensor,
@@ -56,12 +75,62 @@ def pendulum_dynamics_torch(
     return dxdt
 
 
+def rk4_pendulum_step_py(
+    state: torch.Tensor,
+    action: torch.Tensor,
+    dt: float,
+    g: float = 9.81,
+    m: float = 0.15,
+    l: float = 0.5,
+    use_fast_sin: bool = False
+) -> torch.Tensor:
+    """
+    One RK4 step of pendulum_dynamics_torch with the dynamics inlined, so the four
+    stages run as a single function. rk4_pendulum_step is its TorchScript version;
+    this plain Python one is what torch.compile traces, since it cannot trace into TorchScript.
+    """
+    b = 0.1
+    c_grav = g / l
+    c_fric = b / (m * l * l)
+    u = (1.0 / (m * l * l)) * action.squeeze(-1)
+
+    theta = state[..., 0]
+    theta_dot = state[..., 1]
+
+    k1_theta = theta_dot
+    k1_theta_dot = c_grav * _sin(theta, use_fast_sin) - c_fric * theta_dot + u
+
+    theta_2 = theta + 0.5 * dt * k1_theta
+    theta_dot_2 = theta_dot + 0.5 * dt * k1_theta_dot
+    k2_theta = theta_dot_2
+    k2_theta_dot = c_grav * _sin(theta_2, use_fast_sin) - c_fric * theta_dot_2 + u
+
+    theta_3 = theta + 0.5 * dt * k2_theta
+    theta_dot_3 = theta_dot + 0.5 * dt * k2_theta_dot
+    k3_theta = theta_dot_3
+    k3_theta_dot = c_grav * _sin(theta_3, use_fast_sin) - c_fric * theta_dot_3 + u
+
+    theta_4 = theta + dt * k3_theta
+    theta_dot_4 = theta_dot + dt * k3_theta_dot
+    k4_theta = theta_dot_4
+    k4_theta_dot = c_grav * _sin(theta_4, use_fast_sin) - c_fric * theta_dot_4 + u
+
+    theta_next = theta + (dt / 6.0) * (k1_theta + 2 * k2_theta + 2 * k3_theta + k4_theta)
+    theta_dot_next = theta_dot + (dt / 6.0) * (k1_theta_dot + 2 * k2_theta_dot + 2 * k3_theta_dot + k4_theta_dot)
+    return torch.stack([theta_next, theta_dot_next], dim=-1)
+
+
+# fast_sin and _sin are compiled along with it
+rk4_pendulum_step = torch.jit.script(rk4_pendulum_step_py)
+
+
 def pendulum_dynamics_np(
         state: np.ndarray, 
         action: np.ndarray, 
         g: float = 9.81, 
         m: float = 0.15, 
-        l: float = 0.5
+        l: float = 0.5,
+        out: Optional[np.ndarray] = None
 ) -> np.ndarray:
     if state.ndim == 1: # Single sample
         state = state.reshape(1, -1)
@@ -79,10 +148,9 @@ def pendulum_dynamics_np(
     b = 0.1
     theta_ddot = (g / l) * np.sin(theta) - (b / (m * l * l)) * theta_dot + (1.0 / (m * l * l)) * u
 
-    dtheta = theta_dot
-    dtheta_dot = theta_ddot
-
-    dxdt = np.stack([dtheta, dtheta_dot], axis=1)
+    dxdt = np.empty_like(state, dtype=np.result_type(state, u)) if out is None else out
+    dxdt[:, 0] = theta_dot
+    dxdt[:, 1] = theta_ddot
     return dxdt
 
 
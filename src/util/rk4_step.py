@@ -1,8 +1,19 @@
 
-def rk4_step(f, x, u, dt):
-    """RK4 integration step for the continuous-time dynamics."""
-    f1 = f(x, u)
-    f2 = f(x + 0.5 * dt * f1, u)
-    f3 = f(x + 0.5 * dt * f2, u)
-    f4 = f(x + dt * f3, u)
+def rk4_step(f, x, u, dt, bufs=None):
+    """
+    RK4 integration step for the continuous-time dynamics.
+    bufs optionally holds four preallocated stage outputs, passed to f as out=, for dynamics
+    that support it (pendulum_dynamics_np). Only reuse them outside autograd, since every
+    call overwrites them.
+    """
+    if bufs is None:
+        f1 = f(x, u)
+        f2 = f(x + 0.5 * dt * f1, u)
+        f3 = f(x + 0.5 * dt * f2, u)
+        f4 = f(x + dt * f3, u)
+    else:
+        f1 = f(x, u, out=bufs[0])
+        f2 = f(x + 0.5 * dt * f1, u, out=bufs[1])
+        f3 = f(x + 0.5 * dt * f2, u, out=bufs[2])
+        f4 = f(x + dt * f3, u, out=bufs[3])
     return x + (dt / 6.0) * (f1 + 2 * f2 + 2 * f3 + f4)
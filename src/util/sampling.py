@@ -1,7 +1,7 @@
 import numpy as np
 import scipy.linalg
 import torch
-from typing import Tuple
+from typing import Optional, Tuple
 
 
 from models.mlpmultivariategaussian import TwoHeadedMLP
@@ -52,19 +52,32 @@ def sample_out_of_region(num_samples: int, lb: np.ndarray, ub: np.ndarray, scale
     return x
 
 
-def sample_in_region_torch(num_samples: int, lb: torch.Tensor, ub: torch.Tensor, device: str) -> torch.Tensor:
-    return torch.rand(num_samples, lb.shape[0], device=device) * (ub - lb) + lb
+def sample_in_region_torch(num_samples: int, lb: torch.Tensor, ub: torch.Tensor, device: str, generator: torch.Generator = None) -> torch.Tensor:
+    return torch.rand(num_samples, lb.shape[0], generator=generator, device=device) * (ub - lb) + lb
 
 
-def sample_out_of_region_torch(num_samples: int, lb: torch.Tensor, ub: torch.Tensor, scale: float, device: str) -> torch.Tensor:
-    x = torch.rand(num_samples, lb.shape[0], device=device) * 2 - 1  
+def sample_out_of_region_torch(num_samples: int, lb: torch.Tensor, ub: torch.Tensor, scale: float, device: str, generator: torch.Generator = None) -> torch.Tensor:
+    x = torch.rand(num_samples, lb.shape[0], generator=generator, device=device) * 2 - 1  
     ratios = torch.max(torch.abs(x) / (ub * scale), dim=1, keepdim=True).values
     x = x / ratios
-    noise = torch.rand_like(x) * 0.5
+    noise = torch.rand(x.shape, generator=generator, device=device) * 0.5
     x = x + torch.sign(x) * noise
     return x
 
 
+@torch.jit.script
+def sample_out_of_region_scaled_torch(num_samples: int, ub_scaled: torch.Tensor, generator: Optional[torch.Generator] = None) -> torch.Tensor:
+    """
+    Same as sample_out_of_region_torch, but takes the precomputed ub * scale
+    and applies the rescale and noise in place.
+    """
+    x = torch.rand([num_samples, ub_scaled.shape[0]], generator=generator, device=ub_scaled.device).mul_(2).sub_(1)
+    ratios = (x.abs() / ub_scaled).amax(dim=1, keepdim=True)
+    x.div_(ratios)
+    x.addcmul_(torch.sign(x), torch.rand(x.shape, generator=generator, device=x.device).mul_(0.5))
+    return x
+
+
 def sample_from_ellipsoid(c, Nv, x_star, L_cholesky, state_dim):
     if c <= 0:
         return np.array([x_star])